@@ -1,57 +1,86 @@
 # crew_cleaner_agent.py
 
-from bs4 import BeautifulSoup
+import os
+import logging
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from crewai import Agent
+from pydantic import PrivateAttr
 from urllib.parse import urlparse
+from html_cleaning import clean_html
+
+logger = logging.getLogger(__name__)
 
 # Output folder
 OUTPUT_DIR = Path("regulatory_outputs/site_outputs")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-# Tags to remove
-TAGS_TO_REMOVE = ["script", "style", "noscript", "footer", "header", "nav", "aside"]
+# Worker processes for cleaning; parsing holds the GIL, so it gets real processes rather than threads
+CLEANER_WORKERS = int(os.getenv("HSCAN_CLEANER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Never fork the parent: it runs the log listener, Playwright and Streamlit threads
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+if _MP_CONTEXT.get_start_method() == "forkserver":
+    _MP_CONTEXT.set_forkserver_preload(["html_cleaning"])
 
 class CleanerAgent(Agent):
-    def __init__(self):
+    _persist = PrivateAttr(default=True)
+    _pool = PrivateAttr(default=None)
+    _users = PrivateAttr(default=0)
+
+    def __init__(self, persist: bool = True):
         super().__init__(
             name="CleanerAgent",
             role="HTML Cleaner",
             goal="Clean the scraped HTML by removing unnecessary tags, styles, and scripts.",
             backstory="You ensure that downstream agents receive only the most relevant and readable HTML content."
         )
+        # Downstream agents read cleaned_html from memory; the file is only an artifact
+        self._persist = persist
 
+    # --- Worker pool lifecycle (shared across cleans while started) ---
+    # Reference counted like ScraperAgent's browser: only the last stop() shuts the pool down
+    def start(self) -> "CleanerAgent":
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=CLEANER_WORKERS, mp_context=_MP_CONTEXT)
+        self._users += 1
+        return self
 
-    def _clean_html_content(self, raw_html: str) -> str:
-        soup = BeautifulSoup(raw_html, "html.parser")
-
-        for tag in TAGS_TO_REMOVE:
-            for element in soup.find_all(tag):
-                element.decompose()
-
-        # Remove empty or whitespace-only tags
-        for tag in soup.find_all():
-            if not tag.get_text(strip=True) and tag.name not in ["br", "hr"]:
-                tag.decompose()
-
-        return soup.prettify()
+    def stop(self):
+        if self._users == 0:
+            return
+        self._users -= 1
+        if self._users == 0 and self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
 
-    def run(self, input_data: dict) -> dict:
+    async def run(self, input_data: dict) -> dict:
         raw_html = input_data.get("scraped_html")
         url = input_data.get("url")
 
         if not raw_html or not url:
             raise ValueError("Missing 'scraped_html' or 'url' in input_data")
 
-        cleaned_html = self._clean_html_content(raw_html)
+        loop = asyncio.get_running_loop()
+        # Hold a reference for the duration so a concurrent stop() can't shut the pool mid-clean
+        self.start()
+        try:
+            cleaned_html = await loop.run_in_executor(self._pool, clean_html, raw_html)
+        finally:
+            self.stop()
 
         # Save cleaned output
-        domain = urlparse(url).netloc.replace('.', '_')
-        output_path = OUTPUT_DIR / f"{domain}_cleaned.html"
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(cleaned_html)
-        print(f"✅ Cleaned HTML saved to: {output_path}")
+        output_path = None
+        if self._persist:
+            domain = urlparse(url).netloc.replace('.', '_')
+            output_path = OUTPUT_DIR / f"{domain}_cleaned.html"
+            await asyncio.to_thread(output_path.write_text, cleaned_html, encoding="utf-8")
+            logger.info(f"✅ Cleaned HTML saved to: {output_path}")
 
         input_data["cleaned_html"] = cleaned_html
-        input_data["cleaned_file"] = str(output_path)
+        input_data["cleaned_file"] = str(output_path) if output_path else None
         return input_data
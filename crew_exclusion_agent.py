@@ -1,18 +1,21 @@
 # crew_exclusion_agent.py
 
+import logging
 import os
 import json
+import asyncio
 import pandas as pd
 from pathlib import Path
-from dotenv import load_dotenv
 from urllib.parse import urlparse
 from datetime import datetime
-from openai import OpenAI
 from crewai import Agent
+from llm_client import cached_completion, gather_with_semaphore
 
-# Load API key
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
+
+# Max in-flight OpenAI requests per run, and updates reviewed per request
+MAX_CONCURRENCY = 10
+BATCH_SIZE = 20
 
 # Output folder
 OUTPUT_DIR = Path("regulatory_outputs/site_outputs")
@@ -21,9 +24,10 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 EXCLUSION_PROMPT = """
 You are an AI exclusion agent for a large U.S.-based financial institution.
 
-Your job is to review the following regulatory update based on the provided Topic and (if present) Additional Context. You must decide whether the update should be INCLUDED or EXCLUDED from downstream compliance monitoring.
+Your job is to review each of the following numbered regulatory updates based on the provided Topic and (if present) Additional Context. For each update you must decide whether it should be INCLUDED or EXCLUDED from downstream compliance monitoring.
 
-Return your answer as a JSON object with:
+Report your answer by calling emit_reviews with exactly one result per update, each with:
+- "index": the number of the update as listed below
 - "recommendation": either "Include" or "Exclude"
 - "reason": a short explanation (1–2 sentences) explaining your decision
 
@@ -37,12 +41,40 @@ Include items that:
 - Mention compliance, banking operations, risk management, or supervision
 - Involve a firm being fined, penalized, or cited for violations
 
-Review this update:
+Review these updates:
 
-Topic: {topic}
-Additional Context: {additional_context}
+{updates}
 """
 
+REVIEW_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "emit_reviews",
+        "description": "Record the Include/Exclude decision for each numbered update.",
+        "strict": True,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "index": {"type": "integer"},
+                            "recommendation": {"type": "string", "enum": ["Include", "Exclude"]},
+                            "reason": {"type": "string"}
+                        },
+                        "required": ["index", "recommendation", "reason"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["results"],
+            "additionalProperties": False
+        }
+    }
+}
+
 class ExclusionAgent(Agent):
     def __init__(self):
         super().__init__(
@@ -52,36 +84,54 @@ class ExclusionAgent(Agent):
             backstory="You help compliance teams by excluding irrelevant updates like events, appointments, or non-regulatory items."
         )
 
-    def _review_llm(self, topic: str, additional_context: str):
+    async def _create_completion(self, prompt: str) -> list[dict]:
+        return await cached_completion(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "You are a regulatory compliance assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            parse=lambda content: json.loads(content)["results"],
+            temperature=0.2,
+            tools=[REVIEW_TOOL],
+            tool_choice={"type": "function", "function": {"name": "emit_reviews"}},
+            # Strict schemas are only guaranteed with a single tool call
+            parallel_tool_calls=False
+        )
+
+    def _format_update(self, index: int, topic: str, additional_context: str) -> str:
         # ✅ Fix: Handle NaN or non-string additional_context
         if not isinstance(additional_context, str):
             additional_context = ""
         additional_context = additional_context.strip() or "None"
+        return f"{index}. Topic: {topic}\n   Additional Context: {additional_context}"
 
-        prompt = EXCLUSION_PROMPT.format(topic=topic, additional_context=additional_context)
+    async def _review_llm_batch(self, items: list[tuple[str, str]]) -> list[dict]:
+        updates = "\n\n".join(
+            self._format_update(i, topic, context) for i, (topic, context) in enumerate(items, start=1)
+        )
+        prompt = EXCLUSION_PROMPT.format(updates=updates)
 
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a regulatory compliance assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2
-            )
-            content = response.choices[0].message.content.strip()
-            json_start = content.find('{')
-            json_end = content.rfind('}') + 1
-            json_text = content[json_start:json_end]
-            return json.loads(json_text)
+            parsed = await self._create_completion(prompt)
 
         except Exception as e:
-            return {
+            return [{
                 "recommendation": "Exclude",
                 "reason": f"⚠️ LLM parsing error: {str(e)}"
-            }
+            }] * len(items)
 
-    def run(self, input_data: dict) -> dict:
+        by_index = {}
+        for item in parsed:
+            try:
+                by_index[int(item["index"])] = item
+            except (KeyError, TypeError, ValueError):
+                continue
+
+        missing = {"recommendation": "Exclude", "reason": "⚠️ No result returned for this update"}
+        return [by_index.get(i, missing) for i in range(1, len(items) + 1)]
+
+    async def run(self, input_data: dict) -> dict:
         url = input_data.get("url")
         domain = urlparse(url).netloc.replace('.', '_') if url else "unknown"
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -92,25 +142,38 @@ class ExclusionAgent(Agent):
             llm_file = input_data.get("llm_output_file")
             if not llm_file or not os.path.exists(llm_file):
                 raise FileNotFoundError("No valid 'llm_dataframe' or 'llm_output_file' found.")
-            print(f"📥 Loading LLM output from file: {llm_file}")
-            df = pd.read_csv(llm_file)
+            logger.info(f"📥 Loading LLM output from file: {llm_file}")
+            df = await asyncio.to_thread(pd.read_csv, llm_file)
+
+        logger.info(f"🔍 Running exclusion filter on {len(df)} rows")
+
+        topics = df["topic"].fillna("").tolist()
+        contexts = df.get("additional_context", pd.Series([""] * len(df), index=df.index)).fillna("").tolist()
+        items = list(zip(topics, contexts))
+
+        # Review each distinct (topic, context) pair once and fan the result back out
+        unique_items = list(dict.fromkeys(items))
+        if len(unique_items) < len(items):
+            logger.info(f"♻️ Skipping {len(items) - len(unique_items)} duplicate rows")
+        batches = [unique_items[i:i + BATCH_SIZE] for i in range(0, len(unique_items), BATCH_SIZE)]
 
-        print(f"🔍 Running exclusion filter on {len(df)} rows")
+        tasks = [self._review_llm_batch(batch) for batch in batches]
+        batch_results = await gather_with_semaphore(tasks, limit=MAX_CONCURRENCY)
 
-        df["Recommendation"] = ""
-        df["Reason"] = ""
+        reviewed = dict(zip(unique_items, (result for batch in batch_results for result in batch)))
+        results = [reviewed[item] for item in items]
 
-        for i, row in df.iterrows():
-            result = self._review_llm(row["topic"], row.get("additional_context", ""))
-            df.at[i, "Recommendation"] = result.get("recommendation", "Exclude")
-            df.at[i, "Reason"] = result.get("reason", "⚠️ No reason provided")
+        df["Recommendation"] = [result.get("recommendation", "Exclude") for result in results]
+        df["Reason"] = [result.get("reason", "⚠️ No reason provided") for result in results]
 
         output_path = OUTPUT_DIR / f"{domain}_exclusion_checked_{timestamp}.csv"
-        df.to_csv(output_path, index=False, encoding="utf-8-sig")
-        print(f"✅ Exclusion results saved to: {output_path}")
+        await asyncio.to_thread(df.to_csv, output_path, index=False, encoding="utf-8-sig")
+        logger.info(f"✅ Exclusion results saved to: {output_path}")
 
+        # Downstream only iterates rows, so hand back plain records (blank cells as None, not NaN)
+        records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
         return {
             "url": url,
             "exclusion_file": str(output_path),
-            "filtered_dataframe": df
+            "filtered_records": records
         }
@@ -1,84 +1,102 @@
 # crew_html_extractor_agent.py
 
+import logging
 from crewai import Agent
-from pydantic import BaseModel
-from bs4 import BeautifulSoup
-from bs4.element import Tag, NavigableString
+from pydantic import BaseModel, PrivateAttr
+from typing import Optional
+import lxml.html
+from lxml import etree
 from urllib.parse import urlparse, urljoin
 from pathlib import Path
 import os
+import asyncio
+
+logger = logging.getLogger(__name__)
 
 # ✅ Updated absolute output directory
 OUTPUT_DIR = Path(r"C:\Users\hp\Documents\Agent Store 1 - Copy\regulatory_outputs\site_outputs")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Tags whose content is never visible page text
+TAGS_TO_REMOVE = ["script", "style", "noscript", "footer", "header", "nav", "aside"]
+
 class HTMLExtractorInput(BaseModel):
     url: str
-    cleaned_file: str
+    html: Optional[str] = None
+    cleaned_file: Optional[str] = None
 
 class HTMLExtractorOutput(BaseModel):
     url: str
     extracted_text: str
     extracted_links: list
-    extracted_file: str
+    extracted_file: Optional[str] = None
 
 class HTMLExtractorAgent(Agent):
-    def __init__(self):
+    _persist = PrivateAttr(default=True)
+
+    def __init__(self, persist: bool = True):
         super().__init__(
             name="HTMLExtractorAgent",
             role="HTML Content Extractor",
             goal="Extract visible text and links from cleaned HTML for LLM processing.",
             backstory="You work after the HTML has been cleaned, extract human-visible content and links in a format suitable for LLM extraction."
         )
+        self._persist = persist
+
+    def _extract_visible_text_and_links(self, html: str, base_url: str = "") -> tuple[str, list[str]]:
+        if not html.strip():
+            return "", []
+
+        tree = lxml.html.document_fromstring(html)
+        etree.strip_elements(tree, *TAGS_TO_REMOVE, with_tail=False)
+
+        # Collapse each link to "text (href)" in place so it stays inline with the page text;
+        # links is an ordered set (dict keys) so known_links keeps page order across runs
+        links = {}
+        for anchor in list(tree.iter("a")):
+            href = anchor.get("href")
+            if not href:
+                continue
+            text = "".join(part.strip() for part in anchor.itertext())
+            anchor.clear(keep_tail=True)
+            if text:
+                href = urljoin(base_url, href)
+                anchor.text = f"{text} ({href})"
+                links.setdefault(href)
+
+        visible_text = " ".join(
+            part.strip() for part in tree.xpath("//body//text()[normalize-space()]")
+        )
+        return visible_text, list(links)
 
-    def _extract_visible_text_and_links(self, html_path: str, base_url: str = "") -> tuple[str, list[str]]:
-        with open(html_path, "r", encoding="utf-8") as f:
-            soup = BeautifulSoup(f, "html.parser")
-
-        for tag in soup(["script", "style", "noscript", "footer", "header", "nav", "aside"]):
-            tag.decompose()
-
-        result = []
-
-        def traverse(node):
-            if isinstance(node, NavigableString):
-                text = node.strip()
-                if text:
-                    result.append(text)
-            elif isinstance(node, Tag):
-                if node.name == "a" and node.get("href"):
-                    text = node.get_text(strip=True)
-                    href = urljoin(base_url, node["href"])
-                    if text:
-                        result.append(f"{text} ({href})")
-                else:
-                    for child in node.children:
-                        traverse(child)
-
-        traverse(soup.body or soup)
-        visible_text = " ".join(result)
-        links = [part.split(" (")[-1].rstrip(")") for part in result if " (" in part]
-        return visible_text, list(set(links))
-
-    def run(self, input_data: dict) -> dict:
+    async def run(self, input_data: dict) -> dict:
         input_obj = HTMLExtractorInput(**input_data)
-        html_path = input_obj.cleaned_file
         url = input_obj.url
 
-        print(f"🔍 Extracting from: {html_path}")
-        visible_text, links = self._extract_visible_text_and_links(html_path, url)
+        # Prefer the in-memory HTML; fall back to the cleaned file on disk
+        html = input_obj.html
+        if html is None:
+            html_path = input_obj.cleaned_file
+            if not html_path or not os.path.exists(html_path):
+                raise FileNotFoundError("No valid 'html' or 'cleaned_file' found.")
+            logger.info(f"📥 Loading cleaned HTML from file: {html_path}")
+            html = await asyncio.to_thread(Path(html_path).read_text, encoding="utf-8")
 
-        domain = urlparse(url).netloc.replace(".", "_")
-        output_path = OUTPUT_DIR / f"{domain}_extracted.txt"
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(visible_text)
+        logger.info(f"🔍 Extracting from: {url}")
+        # lxml parses in C with the GIL released, so a worker thread is enough
+        visible_text, links = await asyncio.to_thread(self._extract_visible_text_and_links, html, url)
 
-        print(f"✅ Saved extracted content to: {output_path}")
+        output_path = None
+        if self._persist:
+            domain = urlparse(url).netloc.replace(".", "_")
+            output_path = OUTPUT_DIR / f"{domain}_extracted.txt"
+            await asyncio.to_thread(output_path.write_text, visible_text, encoding="utf-8")
+            logger.info(f"✅ Saved extracted content to: {output_path}")
 
         output = HTMLExtractorOutput(
             url=url,
             extracted_text=visible_text,
             extracted_links=links,
-            extracted_file=str(output_path)
+            extracted_file=str(output_path) if output_path else None
         )
         return output.dict()
@@ -1,36 +1,74 @@
 # crew_llm_extractor_agent.py
 
+import logging
 import json
-import re
+import hashlib
+import asyncio
 import pandas as pd
 import os
 from urllib.parse import urlparse
 from pathlib import Path
 from datetime import datetime
-from dotenv import load_dotenv
-from openai import OpenAI
-from difflib import get_close_matches
+from rapidfuzz import fuzz, process
 from crewai import Agent
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from llm_client import cached_completion, gather_with_semaphore
 
-# Load API key
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
 
 # Output path
 OUTPUT_DIR = Path("regulatory_outputs/site_outputs")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+UPDATE_COLUMNS = ["date", "topic", "additional_context", "link", "regulator"]
+
+# ~3k tokens of page text per request, and max in-flight requests per document
+CHUNK_CHARS = 12000
+MAX_CONCURRENCY = 5
+
+UPDATES_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "emit_updates",
+        "description": "Record the regulatory updates found in the document.",
+        "strict": True,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "updates": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "date": {"type": "string"},
+                            "topic": {"type": "string"},
+                            "additional_context": {"type": "string"},
+                            "link": {"type": "string"},
+                            "regulator": {"type": "string"}
+                        },
+                        "required": ["date", "topic", "additional_context", "link", "regulator"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["updates"],
+            "additionalProperties": False
+        }
+    }
+}
+
 # --- Pydantic I/O Schemas ---
 class LLMExtractorInput(BaseModel):
     url: str
-    extracted_file: str
+    extracted_text: Optional[str] = None
+    extracted_file: Optional[str] = None
     extracted_links: List[str]
 
 class LLMExtractorOutput(BaseModel):
     url: str
     llm_output_file: str
+    llm_output_digest: str
 
 # --- Agent Class ---
 class LLMExtractorAgent(Agent):
@@ -42,23 +80,54 @@ class LLMExtractorAgent(Agent):
             backstory="You read visible HTML content and links to extract structured regulatory updates."
         )
 
-    def _classify_with_llm(self, full_text: str, links: List[str]) -> pd.DataFrame:
-        escaped_text = full_text.replace('"', '\\"')
+    def _chunk_text(self, full_text: str) -> List[str]:
+        # Split on whitespace so no word (or "text (href)" link) is cut mid-token
+        chunks = []
+        start = 0
+        while start < len(full_text):
+            end = min(start + CHUNK_CHARS, len(full_text))
+            if end < len(full_text):
+                split = full_text.rfind(" ", start, end)
+                if split > start:
+                    end = split
+            chunk = full_text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            start = end
+        return chunks
+
+    async def _create_completion(self, prompt: str) -> List[dict]:
+        return await cached_completion(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "You extract structured regulatory updates from documents."},
+                {"role": "user", "content": prompt}
+            ],
+            parse=lambda content: json.loads(content)["updates"],
+            temperature=0.2,
+            max_tokens=4096,
+            tools=[UPDATES_TOOL],
+            tool_choice={"type": "function", "function": {"name": "emit_updates"}},
+            # Strict schemas are only guaranteed with a single tool call
+            parallel_tool_calls=False
+        )
+
+    async def _classify_chunk(self, chunk: str, links: List[str]) -> pd.DataFrame:
+        escaped_text = chunk.replace('"', '\\"')
+        # Only offer the links that appear in this chunk; fall back to all of them
+        chunk_links = [link for link in links if link in chunk] or links
         prompt = f"""
 You are a regulatory update extraction assistant.
 
 From the following DOCUMENT CONTENT, extract each distinct regulatory update.
-Return the output as a strict JSON array of objects, each with the following keys:
+Report the updates by calling emit_updates with one object per update, each with the following keys:
 - "date": the date of the update in YYYY-MM-DD format (if available)
 - "topic": short title or subject of the update
 - "additional_context": supporting detail or summary text
 - "link": full URL to the source (choose from known_links)
 - "regulator": the issuing regulatory body
 
-⚠️ Do not include any explanatory text or markdown. Output must start with [ and end with ].
-⚠️ Ensure all string values are wrapped in double quotes. Escape any internal quotes.
-
-Known links to choose from: {json.dumps(links)}
+Known links to choose from: {json.dumps(chunk_links)}
 
 DOCUMENT CONTENT:
 \"\"\"
@@ -66,58 +135,75 @@ DOCUMENT CONTENT:
 \"\"\"
 """
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You extract structured regulatory updates from documents."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2,
-                max_tokens=4096
-            )
-            llm_output = response.choices[0].message.content.strip()
-            cleaned = re.sub(r"^```json|```$", "", llm_output.strip(), flags=re.MULTILINE).strip()
-            parsed = json.loads(cleaned)
+            parsed = await self._create_completion(prompt)
             for item in parsed:
                 if "additional_context" not in item:
                     item["additional_context"] = ""
-            return pd.DataFrame(parsed, columns=["date", "topic", "additional_context", "link", "regulator"])
+            return pd.DataFrame(parsed, columns=UPDATE_COLUMNS)
         except Exception as e:
-            print(f"⚠️ LLM extraction failed: {e}")
-            return pd.DataFrame(columns=["date", "topic", "additional_context", "link", "regulator"])
+            logger.warning(f"⚠️ LLM extraction failed: {e}")
+            return pd.DataFrame(columns=UPDATE_COLUMNS)
+
+    async def _classify_with_llm(self, full_text: str, links: List[str]) -> pd.DataFrame:
+        chunks = self._chunk_text(full_text)
+        if not chunks:
+            return pd.DataFrame(columns=UPDATE_COLUMNS)
+
+        logger.info(f"🧩 Extracting updates from {len(chunks)} chunk(s)")
+        tasks = [self._classify_chunk(chunk, links) for chunk in chunks]
+        frames = await gather_with_semaphore(tasks, limit=MAX_CONCURRENCY)
+
+        # Updates near a chunk boundary can be reported by both neighbours
+        df = pd.concat(frames, ignore_index=True)
+        return df.drop_duplicates(subset=["date", "topic"], ignore_index=True)
 
     def _fix_links(self, df: pd.DataFrame, known_links: List[str]) -> pd.DataFrame:
-        print("🔗 Running fuzzy link match.")
+        logger.info("🔗 Running fuzzy link match.")
+        # Lowercase the corpus once; matches map back to the original-cased link by index
+        known_lower = [link.lower() for link in known_links]
         for i, row in df.iterrows():
             topic = row["topic"]
-            if not row["link"] or row["link"].strip() == "":
-                matches = get_close_matches(topic.lower(), known_links, n=1, cutoff=0.3)
-                if matches:
-                    df.at[i, "link"] = matches[0]
+            link = row["link"]
+            # Missing cells come back as NaN, which is truthy but not a string
+            if not isinstance(link, str) or not link.strip():
+                # WRatio (0-100, with partial-match boosting) at the requested cutoff of 30; this is
+                # looser than the old difflib ratio() >= 0.3, not an equivalent threshold
+                match = process.extractOne(topic.lower(), known_lower, scorer=fuzz.WRatio, score_cutoff=30)
+                if match:
+                    df.at[i, "link"] = known_links[match[2]]
         return df
 
-    def run(self, input_data: dict) -> dict:
+    def _write_output(self, df: pd.DataFrame, output_path: Path) -> str:
+        # Encode once, then write and hash the same bytes so the exclusion cache key never reads the file
+        data = df.to_csv(index=False).encode("utf-8-sig")
+        output_path.write_bytes(data)
+        return hashlib.sha256(data).hexdigest()
+
+    async def run(self, input_data: dict) -> dict:
         input_obj = LLMExtractorInput(**input_data)
-        txt_file = input_obj.extracted_file
         url = input_obj.url
         known_links = input_obj.extracted_links
 
-        if not os.path.exists(txt_file):
-            raise FileNotFoundError(f"Extracted file not found: {txt_file}")
+        # Prefer the in-memory text; fall back to the extracted file on disk
+        full_text = input_obj.extracted_text
+        if full_text is None:
+            txt_file = input_obj.extracted_file
+            if not txt_file or not os.path.exists(txt_file):
+                raise FileNotFoundError(f"Extracted file not found: {txt_file}")
 
-        with open(txt_file, "r", encoding="utf-8") as f:
-            full_text = f.read()
+            full_text = await asyncio.to_thread(Path(txt_file).read_text, encoding="utf-8")
 
-        df = self._classify_with_llm(full_text, known_links)
+        df = await self._classify_with_llm(full_text, known_links)
         df = self._fix_links(df, known_links)
 
         domain = urlparse(url).netloc.replace('.', '_') if url else "unknown"
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         output_path = OUTPUT_DIR / f"{domain}_llm_output_{timestamp}.csv"
-        df.to_csv(output_path, index=False, encoding="utf-8-sig")
+        digest = await asyncio.to_thread(self._write_output, df, output_path)
 
-        print(f"✅ LLM-extracted data saved to: {output_path}")
+        logger.info(f"✅ LLM-extracted data saved to: {output_path}")
         return LLMExtractorOutput(
             url=url,
-            llm_output_file=str(output_path)
+            llm_output_file=str(output_path),
+            llm_output_digest=digest
         ).dict()
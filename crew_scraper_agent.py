@@ -1,13 +1,17 @@
 # crew_scraper_agent.py
 
+import logging
 import asyncio
 import sys
 import os
 from urllib.parse import urljoin, urlparse
 from pathlib import Path
-from playwright.async_api import async_playwright
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+from pydantic import PrivateAttr
 from crewai import Agent
 
+logger = logging.getLogger(__name__)
+
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
@@ -15,14 +19,66 @@ if sys.platform.startswith("win"):
 OUTPUT_DIR = Path("regulatory_outputs/site_outputs")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Only the HTML is used downstream; skip fetching everything else
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+
 class ScraperAgent(Agent):
-    def __init__(self):
+    _playwright = PrivateAttr(default=None)
+    _browser = PrivateAttr(default=None)
+    _users = PrivateAttr(default=0)
+    _lifecycle_lock = PrivateAttr(default=None)
+    _java_script_enabled = PrivateAttr(default=True)
+
+    def __init__(self, java_script_enabled: bool = True):
         super().__init__(
             name="ScraperAgent",
             role="Web Scraper",
             goal="Extract raw HTML from regulatory websites",
             backstory="You automate the collection of online regulatory content for further processing by downstream agents."
         )
+        # Disable for static sites; keep on for JS-rendered listings
+        self._java_script_enabled = java_script_enabled
+
+    # --- Browser lifecycle (shared across scrapes while started) ---
+    # start()/stop() are reference counted so overlapping scans share one browser and
+    # only the last stop() closes it; the lock keeps concurrent callers from double-launching
+    def _lock(self) -> asyncio.Lock:
+        if self._lifecycle_lock is None:
+            self._lifecycle_lock = asyncio.Lock()
+        return self._lifecycle_lock
+
+    async def start(self) -> "ScraperAgent":
+        async with self._lock():
+            if self._browser is None:
+                playwright = await async_playwright().start()
+                try:
+                    self._browser = await playwright.chromium.launch(headless=True)
+                except Exception:
+                    await playwright.stop()
+                    raise
+                self._playwright = playwright
+            self._users += 1
+        return self
+
+    async def stop(self):
+        async with self._lock():
+            if self._users == 0:
+                return
+            self._users -= 1
+            if self._users > 0:
+                return
+            if self._browser is not None:
+                await self._browser.close()
+                self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def __aenter__(self) -> "ScraperAgent":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
 
     async def _convert_links_to_absolute(self, page, base_url):
         await page.evaluate(
@@ -37,22 +93,44 @@ class ScraperAgent(Agent):
             base_url
         )
 
-    async def _scrape_site(self, url: str) -> str:
-        print(f"🔍 Scraping: {url}")
+    async def _block_heavy_resources(self, route):
+        if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _render_page(self, browser, url: str) -> str:
+        context = await browser.new_context(java_script_enabled=self._java_script_enabled)
+        await context.route("**/*", self._block_heavy_resources)
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True)
-                page = await browser.new_page()
-                await page.goto(url, timeout=60000)
-                await page.wait_for_timeout(5000)
+            page = await context.new_page()
+            await page.goto(url, timeout=60000)
+            try:
+                await page.wait_for_load_state("networkidle", timeout=10000)
+            except PlaywrightTimeoutError:
+                # Pages with polling/analytics never go idle; keep what has rendered
+                pass
 
-                await self._convert_links_to_absolute(page, url)
+            await self._convert_links_to_absolute(page, url)
 
-                html = await page.content()
-                await browser.close()
-                return html
+            return await page.content()
+        finally:
+            await context.close()
+
+    async def _scrape_site(self, url: str) -> str:
+        logger.info(f"🔍 Scraping: {url}")
+        try:
+            if self._browser is None:
+                # Standalone call: use a one-off browser without touching the shared one
+                async with async_playwright() as playwright:
+                    browser = await playwright.chromium.launch(headless=True)
+                    try:
+                        return await self._render_page(browser, url)
+                    finally:
+                        await browser.close()
+            return await self._render_page(self._browser, url)
         except Exception as e:
-            print(f"❌ Error scraping {url}: {e}")
+            logger.error(f"❌ Error scraping {url}: {e}")
             return f"<html><body><h1>Error scraping {url}</h1><p>{e}</p></body></html>"
 
     async def run(self, input_data: dict) -> dict:
@@ -65,10 +143,19 @@ class ScraperAgent(Agent):
         # Save output
         domain = urlparse(url).netloc.replace('.', '_')
         output_path = OUTPUT_DIR / f"{domain}_scraped.html"
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(html_output)
-        print(f"✅ HTML saved to {output_path}")
+        await asyncio.to_thread(output_path.write_text, html_output, encoding="utf-8")
+        logger.info(f"✅ HTML saved to {output_path}")
 
         input_data["scraped_html"] = html_output
         input_data["scraped_file"] = str(output_path)
         return input_data
+
+    async def run_many(self, urls: list[str], concurrency: int = 8) -> list[dict]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _bounded(url: str) -> dict:
+            async with semaphore:
+                return await self.run({"url": url})
+
+        async with self:
+            return await asyncio.gather(*(_bounded(url) for url in urls))
@@ -1,13 +1,25 @@
 # horizon_graph.py
 
 import os
+import sys
+import csv
+import json
 import uuid
+import queue
+import atexit
 import asyncio
+import hashlib
+import itertools
+import logging
+import logging.handlers
 from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
 from dotenv import load_dotenv
-from typing import List, Dict
-import pandas as pd
+from typing import List, Dict, Tuple
 from langgraph.graph import StateGraph, END
+from langgraph.cache.memory import InMemoryCache
+from langgraph.types import CachePolicy
 
 from crew_scraper_agent import ScraperAgent
 from crew_cleaner_agent import CleanerAgent
@@ -18,71 +30,118 @@ from crew_exclusion_agent import ExclusionAgent
 load_dotenv()
 State = Dict[str, any]
 
-def log(msg: str):
-    print(msg)
+# Max sites running through the pipeline at once
+MAX_CONCURRENCY = int(os.getenv("HSCAN_MAX_CONCURRENCY", "6"))
+
+# Longest a single site may take end to end, in seconds
+SITE_TIMEOUT = float(os.getenv("HSCAN_SITE_TIMEOUT", "300"))
+
+# How long cached node results stay valid, in seconds
+NODE_CACHE_TTL = 3600
+
+# One instance of each agent is shared by every site and every scan
+_SCRAPER = ScraperAgent()
+_CLEANER = CleanerAgent()
+_HTML_EXTRACTOR = HTMLExtractorAgent()
+_LLM_EXTRACTOR = LLMExtractorAgent()
+_EXCLUSION = ExclusionAgent()
+
+logger = logging.getLogger(__name__)
+
+_LOG_LISTENER = None
+
+# Importing the module leaves logging configuration alone, so anything driving
+# run_horizon_scan (the CLI below, Streamlit, a script or notebook) must call this once
+# to see progress. Every logger enqueues records and a background thread does the stdout writes.
+def setup_logging(level: int = logging.INFO):
+    global _LOG_LISTENER
+    if _LOG_LISTENER is not None:
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    # Root (and so httpx, openai, the agents) only enqueues; the listener owns the stream handler
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _LOG_LISTENER = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _LOG_LISTENER.start()
+    atexit.register(_LOG_LISTENER.stop)
 
 def generate_run_id():
     return f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
 
 # --- LangGraph Nodes ---
 async def scraper_node(state: State) -> State:
-    log(f"🌐 [ScraperNode] Scraping from: {state['url']}")
-    return await ScraperAgent().run(state)
+    logger.info(f"🌐 [ScraperNode] Scraping from: {state['url']}")
+    return await _SCRAPER.run(state)
 
-def cleaner_node(state: State) -> State:
-    log("🧼 [CleanerNode] Cleaning HTML...")
-    return CleanerAgent().run(state)
+async def cleaner_node(state: State) -> State:
+    logger.info("🧼 [CleanerNode] Cleaning HTML...")
+    return await _CLEANER.run(state)
 
-def html_extractor_node(state: State) -> State:
-    log("🔍 [HTMLExtractorNode] Extracting visible content and links...")
-    return HTMLExtractorAgent().run({
+async def html_extractor_node(state: State) -> State:
+    logger.info("🔍 [HTMLExtractorNode] Extracting visible content and links...")
+    return await _HTML_EXTRACTOR.run({
         "url": state["url"],
-        "cleaned_file": state["cleaned_file"]
+        "html": state.get("cleaned_html"),
+        "cleaned_file": state.get("cleaned_file")
     })
 
-def llm_extractor_node(state: State) -> State:
-    log("🤖 [LLMExtractorNode] Extracting updates with LLM...")
-    return LLMExtractorAgent().run({
+async def llm_extractor_node(state: State) -> State:
+    logger.info("🤖 [LLMExtractorNode] Extracting updates with LLM...")
+    return await _LLM_EXTRACTOR.run({
         "url": state["url"],
-        "extracted_file": state["extracted_file"],
+        "extracted_text": state.get("extracted_text"),
+        "extracted_file": state.get("extracted_file"),
         "extracted_links": state["extracted_links"]
     })
 
-def exclusion_node(state: State) -> State:
-    log("🚫 [ExclusionNode] Filtering updates...")
-    state = ExclusionAgent().run({
+async def exclusion_node(state: State) -> State:
+    logger.info("🚫 [ExclusionNode] Filtering updates...")
+    return await _EXCLUSION.run({
         "url": state["url"],
         "llm_output_file": state["llm_output_file"]
     })
-    state["final_updates"] = state.get("filtered_dataframe", pd.DataFrame()).to_dict(orient="records")
-    return state
 
 def output_node(state: State) -> State:
-    updates = state.get("final_updates", [])
     source_url = state.get("url", "unknown")
     run_id = state.get("run_id", "none")
-
-    if "combined_updates" not in state:
-        state["combined_updates"] = []
-
-    enriched_updates = []
-    for item in updates:
-        item = dict(item)
-        item.setdefault("source_url", source_url)
-        item.setdefault("run_id", run_id)
-        enriched_updates.append(item)
-
-    state["combined_updates"].extend(enriched_updates)
+    # One new dict per record (cached records stay untouched), no setdefault branching
+    state["enriched_updates"] = [
+        {**item, "source_url": source_url, "run_id": run_id}
+        for item in state.get("filtered_records", [])
+    ]
     return state
 
+# --- Node Cache Keys ---
+# Keys hash only the content a node depends on, so run_id and timestamped paths don't defeat them
+def content_key(*fields: str):
+    def key_func(state: State) -> str:
+        digest = hashlib.sha256()
+        for field in fields:
+            digest.update(str(state.get(field)).encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+    return key_func
+
 # --- LangGraph Assembly ---
 def build_graph():
     graph = StateGraph(State)
     graph.add_node("scraper", scraper_node)
-    graph.add_node("cleaner", cleaner_node)
-    graph.add_node("html_extractor", html_extractor_node)
-    graph.add_node("llm_extractor", llm_extractor_node)
-    graph.add_node("exclusion", exclusion_node)
+    graph.add_node("cleaner", cleaner_node, cache_policy=CachePolicy(
+        key_func=content_key("url", "scraped_html"), ttl=NODE_CACHE_TTL))
+    graph.add_node("html_extractor", html_extractor_node, cache_policy=CachePolicy(
+        key_func=content_key("url", "cleaned_html"), ttl=NODE_CACHE_TTL))
+    graph.add_node("llm_extractor", llm_extractor_node, cache_policy=CachePolicy(
+        key_func=content_key("url", "extracted_text", "extracted_links"), ttl=NODE_CACHE_TTL))
+    graph.add_node("exclusion", exclusion_node, cache_policy=CachePolicy(
+        key_func=content_key("url", "llm_output_digest"), ttl=NODE_CACHE_TTL))
     graph.add_node("output", output_node)
 
     graph.set_entry_point("scraper")
@@ -93,30 +152,114 @@ def build_graph():
     graph.add_edge("exclusion", "output")
     graph.add_edge("output", END)
 
-    return graph.compile()
+    return graph.compile(cache=InMemoryCache())
+
+# The topology never changes, so compile it once per process
+APP = build_graph()
+
+def write_csv(path: Path, rows: List[Dict]):
+    # Header is the union of keys in first-seen order
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def write_manifest(path: Path, manifest: Dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+async def run_single_site(app, url: str, semaphore: asyncio.Semaphore) -> Tuple[str, List[Dict]]:
+    async with semaphore:
+        run_id = generate_run_id()
+        state = {"url": url, "run_id": run_id}
+        logger.info(f"🚀 Starting pipeline for: {url}")
+        # A hung or failing site yields no updates instead of stalling or aborting the scan
+        try:
+            result = await asyncio.wait_for(app.ainvoke(state), timeout=SITE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱️ Timed out after {SITE_TIMEOUT:.0f}s: {url}")
+            return url, []
+        except Exception as e:
+            logger.error(f"❌ Pipeline failed for {url}: {e}")
+            return url, []
+        return url, result.get("enriched_updates", [])
 
-async def run_single_site(app, url: str) -> List[Dict]:
-    run_id = generate_run_id()
-    state = {"url": url.strip(), "run_id": run_id}
-    log(f"🚀 Starting pipeline for: {url}")
-    result = await app.ainvoke(state)
-    return result.get("combined_updates", [])
+async def run_horizon_scan(urls: List[str], return_updates: bool = False, app=None):
+    app = app or APP
 
-async def run_horizon_scan(urls: List[str], return_updates: bool = False):
-    app = build_graph()
-    tasks = [run_single_site(app, url) for url in urls]
-    all_results = await asyncio.gather(*tasks)
-    all_updates = [item for sublist in all_results for item in sublist]
+    # Strip, validate and de-duplicate once; bad URLs fail here instead of mid-pipeline
+    stripped = [url.strip() for url in urls]
+    urls = list(dict.fromkeys(url for url in stripped if url.lower().startswith(("http://", "https://"))))
+    rejected = [url for url in stripped if url and url not in urls]
+    if rejected:
+        logger.warning(f"⚠️ Skipping invalid URLs: {', '.join(rejected)}")
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    merged_path = f"regulatory_outputs/horizon_scan_combined_{timestamp}.csv"
-    os.makedirs("regulatory_outputs", exist_ok=True)
+    # Same-second scans get their own folder and combined file
+    scan_id = f"{timestamp}_{uuid.uuid4().hex[:6]}"
+    shard_dir = Path("regulatory_outputs") / scan_id
+    merged_path = Path("regulatory_outputs") / f"horizon_scan_combined_{scan_id}.csv"
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    # Write one CSV per site as soon as it finishes
+    site_updates = []
+    manifest = []
+    shard_counts = {}
+    tasks = []
+    # Every site in this scan scrapes through one shared browser and cleans in one
+    # worker pool, so bring both up first (reference counted, so overlapping scans are safe)
+    await _SCRAPER.start()
+    try:
+        _CLEANER.start()
+    except Exception:
+        await _SCRAPER.stop()
+        raise
+    try:
+        # Schedule every site now so the first ones start while the rest are still queued
+        tasks = [asyncio.create_task(run_single_site(app, url, semaphore)) for url in urls]
+        for next_site in asyncio.as_completed(tasks):
+            url, updates = await next_site
+            entry = {"url": url, "file": None, "rows": len(updates)}
+            if updates:
+                host = urlparse(url).netloc.replace(".", "_")
+                shard_counts[host] = shard_counts.get(host, 0) + 1
+                suffix = f"_{shard_counts[host]}" if shard_counts[host] > 1 else ""
+                shard_path = shard_dir / f"{host}{suffix}.csv"
+                # Encode in a worker thread so the remaining sites keep running meanwhile
+                await asyncio.to_thread(write_csv, shard_path, updates)
+                entry["file"] = str(shard_path)
+                site_updates.append(updates)
+            manifest.append(entry)
+    finally:
+        for task in tasks:
+            task.cancel()
+        _CLEANER.stop()
+        await _SCRAPER.stop()
 
+    # Flatten every site's records in one C-level pass once the scan is done
+    all_updates = list(itertools.chain.from_iterable(site_updates))
     if all_updates:
-        pd.DataFrame(all_updates).to_csv(merged_path, index=False)
-        log(f"✅ Combined results saved to: {merged_path}")
+        await asyncio.to_thread(write_csv, merged_path, all_updates)
+        logger.info(f"✅ Combined results saved to: {merged_path}")
     else:
-        log("⚠️ No updates found.")
+        logger.warning("⚠️ No updates found.")
+
+    await asyncio.to_thread(write_manifest, shard_dir / "manifest.json", {
+        "scan_id": scan_id,
+        "timestamp": timestamp,
+        "combined_file": str(merged_path) if all_updates else None,
+        "sites": manifest
+    })
 
     if return_updates:
         return all_updates
+
+if __name__ == "__main__":
+    # Usage: python horizon_graph.py URL [URL ...]
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python horizon_graph.py URL [URL ...]")
+    setup_logging()
+    asyncio.run(run_horizon_scan(sys.argv[1:]))
@@ -0,0 +1,58 @@
+# html_cleaning.py
+# Kept free of crewai/pydantic so cleaner worker processes start with only the parsers imported
+
+import os
+from bs4 import BeautifulSoup
+from bs4.element import Comment, NavigableString
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# Tags to remove
+TAGS_TO_REMOVE = ["script", "style", "noscript", "footer", "header", "nav", "aside"]
+
+# Cleaning backend: "selectolax" (default, falls back if not installed) or "bs4"
+USE_SELECTOLAX = (
+    os.getenv("HSCAN_CLEANER_BACKEND", "selectolax").lower() == "selectolax"
+    and LexborHTMLParser is not None
+)
+
+def _clean_with_lexbor(raw_html: str) -> str:
+    tree = LexborHTMLParser(raw_html)
+    tree.strip_tags(TAGS_TO_REMOVE)
+
+    # Remove empty or whitespace-only tags, children first so parents see the result
+    if tree.root is not None:
+        for node in reversed(list(tree.root.traverse(include_text=False))):
+            if node.tag in ("html", "br", "hr"):
+                continue
+            if not node.text(deep=True, strip=True):
+                node.decompose()
+
+    return tree.html or ""
+
+def _clean_with_bs4(raw_html: str) -> str:
+    soup = BeautifulSoup(raw_html, "lxml")
+
+    for element in soup.find_all(TAGS_TO_REMOVE):
+        element.decompose()
+
+    # Remove empty or whitespace-only tags in one bottom-up pass: by the time a tag
+    # is visited its empty children are gone, so checking direct children is enough
+    for tag in reversed(soup.find_all()):
+        if tag.name in ["br", "hr"]:
+            continue
+        if all(
+            isinstance(child, NavigableString) and (isinstance(child, Comment) or not child.strip())
+            for child in tag.contents
+        ):
+            tag.decompose()
+
+    return soup.prettify()
+
+def clean_html(raw_html: str) -> str:
+    if USE_SELECTOLAX:
+        return _clean_with_lexbor(raw_html)
+    return _clean_with_bs4(raw_html)
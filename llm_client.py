@@ -0,0 +1,109 @@
+# llm_client.py
+
+import os
+import json
+import asyncio
+import hashlib
+import weakref
+from pathlib import Path
+from functools import lru_cache
+from typing import Any, Callable
+from dotenv import load_dotenv
+from diskcache import Cache
+import openai
+from openai import AsyncOpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+# httpx connection pools are bound to the event loop that opened them,
+# so async clients are shared per running loop rather than globally
+_ASYNC_CLIENTS = weakref.WeakKeyDictionary()
+
+# Completions are cached on (model, request); set HSCAN_NO_CACHE=1 to force a refresh
+CACHE_DIR = Path("~/.cache/hscan-llm").expanduser()
+
+@lru_cache(maxsize=1)
+def _api_key() -> str:
+    # Load API key
+    load_dotenv()
+    return os.getenv("OPENAI_API_KEY")
+
+def get_async_client() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None:
+        # tenacity owns retries; SDK retries on top would multiply the attempts per request
+        client = AsyncOpenAI(api_key=_api_key(), max_retries=0)
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+async def gather_with_semaphore(tasks, limit: int) -> list:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _bounded(task):
+        async with semaphore:
+            return await task
+
+    return await asyncio.gather(*(_bounded(task) for task in tasks))
+
+@lru_cache(maxsize=1)
+def _cache() -> Cache:
+    return Cache(str(CACHE_DIR))
+
+def _cache_enabled() -> bool:
+    return os.getenv("HSCAN_NO_CACHE", "").lower() not in ("1", "true", "yes")
+
+def _cache_key(model: str, messages: list[dict], params: dict) -> str:
+    request = json.dumps({"messages": messages, **params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256((model + "\x00" + request).encode("utf-8")).hexdigest()
+
+# Only rate limits and transient server/network failures can succeed on a retry
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+@retry(
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    wait=wait_exponential(multiplier=1, max=20),
+    stop=stop_after_attempt(3),
+    reraise=True
+)
+async def _create_completion(model: str, messages: list[dict], **params):
+    return await get_async_client().chat.completions.create(model=model, messages=messages, **params)
+
+def _raw(content: str) -> str:
+    return content
+
+def _cache_get(key: str):
+    return _cache().get(key)
+
+def _cache_set(key: str, content: str):
+    _cache().set(key, content)
+
+async def cached_completion(model: str, messages: list[dict], parse: Callable[[str], Any] = _raw, **params) -> Any:
+    # parse raises on a malformed reply; only replies it accepts are ever cached
+    key = _cache_key(model, messages, params)
+    if _cache_enabled():
+        # sqlite lookups block, so keep them off the event loop
+        content = await asyncio.to_thread(_cache_get, key)
+        if content is not None:
+            try:
+                return parse(content)
+            except Exception:
+                pass  # unusable entry, fetch a fresh reply and overwrite it
+
+    response = await _create_completion(model, messages, **params)
+    choice = response.choices[0]
+    message = choice.message
+    # Forced tool calls carry their JSON in the call arguments, not the content;
+    # a split reply would silently drop the extra calls, so reject it instead
+    if message.tool_calls and len(message.tool_calls) > 1:
+        raise ValueError(f"Expected one tool call, got {len(message.tool_calls)}")
+    content = message.tool_calls[0].function.arguments if message.tool_calls else message.content
+    result = parse(content)
+    # Truncated ("length") or filtered replies may still parse, but must not stick in the cache
+    if content is not None and choice.finish_reason in ("stop", "tool_calls"):
+        await asyncio.to_thread(_cache_set, key, content)
+    return result
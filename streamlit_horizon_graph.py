@@ -2,10 +2,39 @@
 
 import streamlit as st
 import asyncio
+import threading
 import pandas as pd
-from horizon_graph import run_horizon_scan
+from horizon_graph import build_graph, run_horizon_scan, setup_logging
+
+try:
+    import uvloop
+except ImportError:  # not available on Windows
+    uvloop = None
 
 st.set_page_config(page_title="Horizon Scanner", layout="wide")
+
+@st.cache_resource
+def init_logging():
+    # Script reruns must not stack handlers or start a second listener
+    setup_logging()
+
+init_logging()
+
+@st.cache_resource
+def get_app():
+    # Compiled graph survives Streamlit reruns
+    return build_graph()
+
+@st.cache_resource
+def get_loop():
+    # One loop for the app's lifetime, so per-loop LLM client pools survive between scans
+    return uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+
+@st.cache_resource
+def get_loop_lock():
+    # Sessions run in separate threads; only one can drive the shared loop at a time
+    return threading.Lock()
+
 st.title("🧠 Horizon Scanning - Multi-Site LangGraph Runner")
 
 st.markdown("Enter up to 11 regulatory site URLs (comma-separated):")
@@ -24,7 +53,10 @@ if st.button("▶️ Run Horizon Scan"):
         st.info("⏳ Running agents and processing sites...")
         with st.spinner("Processing..."):
             try:
-                updates = asyncio.run(run_horizon_scan(urls, return_updates=True))
+                with get_loop_lock():
+                    updates = get_loop().run_until_complete(
+                        run_horizon_scan(urls, return_updates=True, app=get_app())
+                    )
                 if updates:
                     df = pd.DataFrame(updates)
 